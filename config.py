@@ -1,5 +1,7 @@
 # Configuration file for the Multi-Agent System UI
 
+from types import MappingProxyType
+
 # UI Configuration
 UI_CONFIG = {
     "page_title": "🤖 Multi-Agent System",
@@ -19,7 +21,7 @@ TASK_TEMPLATES = {
 }
 
 # Agent Configuration
-AGENTS = {
+AGENTS = MappingProxyType({
     "planner": {
         "name": "Planner",
         "description": "Central planning and coordination agent",
@@ -38,18 +40,22 @@ AGENTS = {
         "icon": "🌐",
         "color": "#34a853"
     }
-}
+})
 
 # Status Configuration
-STATUS_CONFIG = {
+STATUS_CONFIG = MappingProxyType({
     "idle": {"icon": "⚪", "color": "#6c757d"},
     "running": {"icon": "🟡", "color": "#ffc107"},
     "success": {"icon": "🟢", "color": "#28a745"},
     "error": {"icon": "🔴", "color": "#dc3545"}
-}
+})
+
+# Flat lookups for per-render icon access
+AGENT_ICONS = MappingProxyType({k: v["icon"] for k, v in AGENTS.items()})
+STATUS_ICONS = MappingProxyType({k: v["icon"] for k, v in STATUS_CONFIG.items()})
 
 # Theme Configuration
-THEME = {
+THEME = MappingProxyType({
     "primary_color": "#667eea",
     "secondary_color": "#764ba2",
     "success_color": "#28a745",
@@ -57,7 +63,7 @@ THEME = {
     "error_color": "#dc3545",
     "background_color": "#f8f9fa",
     "text_color": "#212529"
-}
+})
 
 # Export Configuration
 EXPORT_CONFIG = {
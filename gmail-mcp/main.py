@@ -1,32 +1,55 @@
 from __future__ import annotations
 
+import asyncio
 import base64
+import codecs
 import os.path
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+import google_auth_httplib2
+import httplib2
 
-from fastapi import FastAPI, HTTPException, Query
+from cachetools import LRUCache, TTLCache
+from fastapi import FastAPI, HTTPException, Query, Request as HTTPRequest, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi_mcp import FastApiMCP
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+import orjson
 import uvicorn
 
 # ──────────────────────────────────────────────────────────────────────────────
 # FastAPI app
 # ──────────────────────────────────────────────────────────────────────────────
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the Gmail service once per worker process at startup."""
+    try:
+        await asyncio.to_thread(get_service)
+    except Exception as e:
+        print(f"Gmail service not ready at startup, will retry on first request: {e}")
+    yield
+
+
 app = FastAPI(
     title="Gmail API Server",
     description="A FastAPI server for accessing Gmail messages",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-mcp = FastApiMCP(app)
+# NDJSON streams are for HTTP clients; MCP tools expect a single JSON result
+mcp = FastApiMCP(app, exclude_operations=["stream_gmail_messages"])
 mcp.mount()
 
 # Gmail OAuth / API helpers
@@ -35,13 +58,32 @@ SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 BASE_DIR = Path(__file__).resolve().parent
 CREDS_FILE = BASE_DIR / "credentials.json"
 TOKEN_FILE = BASE_DIR / "token.json"
+HTTP_TIMEOUT = 30
 
 _service = None  # module-level cache
+_credentials: Credentials | None = None  # set with _service, under _service_lock
+_service_lock = threading.Lock()
+_thread_local = threading.local()  # per-thread Http, httplib2 is not thread-safe
+
+# (query, max_results, include_body, max_chars) -> (historyId, dumped MessagesListResponse)
+_listing_cache: TTLCache = TTLCache(maxsize=256, ttl=60)
+
+# (msg_id, include_body, max_chars) -> MessageDetail; delivered messages never change
+_message_cache: LRUCache = LRUCache(maxsize=4096)
+_message_cache_lock = threading.Lock()
+
+# Gmail rejects batch requests with more than 100 inner calls
+BATCH_SIZE = 100
+
+# Headers requested when listing messages without their bodies
+METADATA_HEADERS = ["Subject", "From", "To", "Date", "Content-Type"]
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Pydantic models
 # ──────────────────────────────────────────────────────────────────────────────
 class MessageDetail(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: str
     subject: str
     sender: str
@@ -53,6 +95,8 @@ class MessageDetail(BaseModel):
 
 
 class MessagesListResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     messages: List[MessageDetail]
     count: int
     query: str
@@ -68,47 +112,99 @@ class ErrorResponse(BaseModel):
 # ──────────────────────────────────────────────────────────────────────────────
 # Gmail helper functions
 # ──────────────────────────────────────────────────────────────────────────────
-def extract_text_from_payload(payload):
-    """Extract plain text content from Gmail message payload."""
-    if payload.get("parts"):
-        # Multipart message
-        for part in payload["parts"]:
-            if part["mimeType"] == "text/plain" and part.get("body", {}).get("data"):
-                return base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8")
-            # Recursively check nested parts
-            if part.get("parts"):
-                nested_text = extract_text_from_payload(part)
-                if nested_text:
-                    return nested_text
-    else:
-        # Simple message
-        if payload.get("mimeType") == "text/plain" and payload.get("body", {}).get("data"):
-            return base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8")
+def extract_text_from_payload(payload, max_chars: Optional[int] = None):
+    """
+    Extract plain text content from Gmail message payload.
+
+    When ``max_chars`` is set, only enough of the base64 data is decoded to
+    produce that many characters, and the result is cut to ``max_chars``.
+    """
+    # Pre-order walk in document order, so a body inside multipart/alternative
+    # wins over a text/plain footer appended later (e.g. mailing-list footers)
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if part.get("mimeType") == "text/plain":
+            data = part.get("body", {}).get("data")
+            if data:
+                if max_chars is None:
+                    return base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+                # A character is at most 4 UTF-8 bytes; every 4 base64 characters decode to 3 bytes
+                sliced = data[:-(-max_chars * 4 // 3) * 4]
+                truncated = len(sliced) < len(data)
+                sliced += "=" * (-len(sliced) % 4)
+                # Not final when truncated, so a split trailing character is dropped, not replaced
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                text = decoder.decode(base64.urlsafe_b64decode(sliced), final=not truncated)
+                return text[:max_chars]
+        stack.extend(reversed(part.get("parts") or ()))
     return None
 def has_attachment(payload):
-    if payload.get("filename"):
-        return True
-    if "parts" in payload:
-        return any(has_attachment(part) for part in payload["parts"])
+    queue = deque([payload])
+    while queue:
+        part = queue.popleft()
+        if part.get("filename"):
+            return True
+        queue.extend(part.get("parts") or ())
     return False
+def _authorized_http(creds: Credentials):
+    """Build a keep-alive Http that signs requests with ``creds``."""
+    http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return google_auth_httplib2.AuthorizedHttp(creds, http=http)
+
+
 def get_service():
     """Return an authenticated gmail v1 service, refreshing / re-authing if needed."""
-    global _service
+    global _service, _credentials
     if _service:
         return _service
 
-    creds: Credentials | None = None
-    if TOKEN_FILE.exists():
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+    with _service_lock:
+        if _service:
+            return _service
+
+        creds: Credentials | None = None
+        if TOKEN_FILE.exists():
+            creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+                TOKEN_FILE.write_text(creds.to_json())
+            else:
+                print("No credentials found, creating new ones by running login.py")
+
+        _credentials = creds
+        # static_discovery uses the discovery document bundled with the client library
+        _service = build(
+            "gmail", "v1",
+            http=_authorized_http(creds),
+            cache_discovery=False,
+            static_discovery=True,
+        )
+        return _service
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            print("No credentials found, creating new ones by running login.py")
 
-    _service = build("gmail", "v1", credentials=creds)
-    return _service
+def get_history_id(service) -> str:
+    """Return the mailbox's current historyId."""
+    profile = service.users().getProfile(userId="me").execute(http=_thread_http())
+    return profile["historyId"]
+
+
+def mailbox_changed_since(service, history_id: str) -> bool:
+    """Return True if the mailbox has any history records after ``history_id``."""
+    try:
+        resp = (
+            service.users()
+            .history()
+            .list(userId="me", startHistoryId=history_id, maxResults=1)
+            .execute(http=_thread_http())
+        )
+    except HttpError as error:
+        # Gmail answers 404 once the start id is too old to diff against
+        print(f"History lookup failed, treating mailbox as changed: {error}")
+        return True
+    return bool(resp.get("history"))
 
 
 def list_message_ids(service, *, max_results: int = 10, query: str | None = None):
@@ -118,7 +214,7 @@ def list_message_ids(service, *, max_results: int = 10, query: str | None = None
             service.users()
             .messages()
             .list(userId="me", maxResults=max_results, q=query)
-            .execute()
+            .execute(http=_thread_http())
         )
         return [m["id"] for m in resp.get("messages", [])]
     except HttpError as error:
@@ -126,31 +222,65 @@ def list_message_ids(service, *, max_results: int = 10, query: str | None = None
         return []
 
 
-def fetch_message(service, msg_id: str) -> Optional[dict]:
-    """Fetch message details: id, subject, from, to, date, and body."""
+def _message_request(service, msg_id: str, include_body: bool):
+    """Build a messages.get request, asking only for headers unless the body is needed."""
+    if include_body:
+        return service.users().messages().get(userId="me", id=msg_id, format="full")
+    return service.users().messages().get(
+        userId="me", id=msg_id, format="metadata", metadataHeaders=METADATA_HEADERS
+    )
+
+
+def _thread_http():
+    """Return the authorized Http owned by the calling thread, creating it on first use."""
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        with _service_lock:
+            creds = _credentials
+        http = _thread_local.http = _authorized_http(creds)
+    return http
+
+
+def _build_message_detail(
+    response: dict, include_body: bool, max_chars: Optional[int] = None
+) -> MessageDetail:
+    """Turn a messages.get response into a MessageDetail."""
+    payload = response.get("payload", {})
+    # One pass over the headers, keyed by lowercased name
+    headers = {h["name"].lower(): h["value"] for h in payload.get("headers", [])}
+    detail = MessageDetail(
+        id=response.get("id"),
+        subject=headers.get("subject", "No Subject"),
+        sender=headers.get("from", "Unknown Sender"),
+        to=headers.get("to", "Unknown Recipient"),
+        date=headers.get("date", "No Date"),
+        # Metadata responses carry no MIME parts; multipart/mixed usually means attachments
+        has_attachment=headers.get("content-type", "").lower().startswith("multipart/mixed"),
+    )
+    if include_body:
+        body = extract_text_from_payload(payload, max_chars)
+        detail.has_attachment = has_attachment(payload)
+        detail.body = body if body else "(no plain-text body found)"
+    return detail
+
+
+def fetch_message(
+    service, msg_id: str, include_body: bool = True, max_chars: Optional[int] = None
+) -> Optional[MessageDetail]:
+    """Fetch message details: id, subject, from, to, date, and (optionally) body."""
+    if not include_body:
+        max_chars = None  # no body to truncate; keep one cache entry per message
+    key = (msg_id, include_body, max_chars)
+    with _message_cache_lock:
+        cached = _message_cache.get(key)
+    if cached is not None:
+        return cached
     try:
-        msg = service.users().messages().get(userId="me", id=msg_id, format="full").execute()
-        payload = msg.get("payload", {})
-        headers = payload.get("headers", [])
-
-        # Extract headers
-        subject = next((h["value"] for h in headers if h["name"].lower() == "subject"), "No Subject")
-        sender = next((h["value"] for h in headers if h["name"].lower() == "from"), "Unknown Sender")
-        to = next((h["value"] for h in headers if h["name"].lower() == "to"), "Unknown Recipient")
-        date = next((h["value"] for h in headers if h["name"].lower() == "date"), "No Date")
-        
-        # Extract plain text from message
-        body = extract_text_from_payload(payload)
-        
-        return {
-            "id": msg_id,
-            "subject": subject,
-            "sender": sender,
-            "to": to,
-            "date": date,
-            "body": body if body else "(no plain-text body found)"
-        }
-        
+        msg = _message_request(service, msg_id, include_body).execute(http=_thread_http())
+        detail = _build_message_detail(msg, include_body, max_chars)
+        with _message_cache_lock:
+            _message_cache[key] = detail
+        return detail
     except HttpError as error:
         print(f"An error occurred fetching message {msg_id}: {error}")
         return None
@@ -160,42 +290,89 @@ def fetch_message(service, msg_id: str) -> Optional[dict]:
 
 
 
-def fetch_messages_in_batch(service, msg_ids: List[str]) -> List[MessageDetail]:
-    """Fetches details for a list of message IDs in a single batch request."""
-    detailed_messages: List[MessageDetail] = []
-    
+async def iter_messages_in_batch(
+    service, msg_ids: List[str], include_body: bool = False, max_chars: Optional[int] = None
+) -> AsyncIterator[tuple[int, MessageDetail]]:
+    """
+    Yield ``(index, MessageDetail)`` pairs as soon as each message arrives.
+
+    Messages already in the message cache are yielded first; the remaining
+    IDs are split into chunks of at most BATCH_SIZE, each sent as its own batch
+    request concurrently. If a batch request fails, its chunk falls back to
+    fetching messages one by one. ``index`` is the position in ``msg_ids``;
+    messages are yielded in arrival order. Bodies are only downloaded when
+    ``include_body`` is set, truncated to ``max_chars`` when given.
+    """
+    if not include_body:
+        max_chars = None  # no body to truncate; keep one cache entry per message
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
     def batch_callback(request_id, response, exception):
+        # Runs in the worker thread executing the batch
         if exception:
             print(f"Error in batch request {request_id}: {exception}")
         else:
-            # Process the response from fetch_message logic
-            payload = response.get("payload", {})
-            headers = payload.get("headers", [])
-            subject = next((h["value"] for h in headers if h["name"].lower() == "subject"), "No Subject")
-            sender = next((h["value"] for h in headers if h["name"].lower() == "from"), "Unknown Sender")
-            to = next((h["value"] for h in headers if h["name"].lower() == "to"), "Unknown Recipient")
-            date = next((h["value"] for h in headers if h["name"].lower() == "date"), "No Date")
-            
-            body = extract_text_from_payload(payload)
-            
-            msg_detail = MessageDetail(
-                id=response.get("id"),
-                subject=subject,
-                sender=sender,
-                to=to,
-                date=date,
-                has_attachment=has_attachment(payload),
-                body=body if body else "(no plain-text body found)"
+            # Parsed here, off the event loop; bounded decoding is cheaper than
+            # pickling the full response to another process
+            detail = _build_message_detail(response, include_body, max_chars)
+            loop.call_soon_threadsafe(queue.put_nowait, (int(request_id), detail))
+
+    def execute_chunk(chunk: List[tuple[int, str]]):
+        batch = service.new_batch_http_request(callback=batch_callback)
+        for index, msg_id in chunk:
+            batch.add(
+                _message_request(service, msg_id, include_body),
+                request_id=str(index),
             )
-            detailed_messages.append(msg_detail)
-
-    batch = service.new_batch_http_request(callback=batch_callback)
-
-    for msg_id in msg_ids:
-        batch.add(service.users().messages().get(userId="me", id=msg_id, format="full"))
-
-    batch.execute()
-    return detailed_messages
+        batch.execute(http=_thread_http())
+
+    async def run_chunk(chunk: List[tuple[int, str]]):
+        try:
+            await asyncio.to_thread(execute_chunk, chunk)
+        except HttpError as error:
+            print(f"Batch request failed, fetching messages individually: {error}")
+            fetched = await asyncio.gather(
+                *[asyncio.to_thread(fetch_message, service, msg_id, include_body, max_chars) for _, msg_id in chunk]
+            )
+            for (index, _), msg in zip(chunk, fetched):
+                if msg:
+                    queue.put_nowait((index, msg))
+
+    # Only cache misses go over the wire
+    misses: List[tuple[int, str]] = []
+    with _message_cache_lock:
+        for index, msg_id in enumerate(msg_ids):
+            cached = _message_cache.get((msg_id, include_body, max_chars))
+            if cached is not None:
+                queue.put_nowait((index, cached))
+            else:
+                misses.append((index, msg_id))
+
+    chunks = [misses[i:i + BATCH_SIZE] for i in range(0, len(misses), BATCH_SIZE)]
+    done = asyncio.gather(*[run_chunk(chunk) for chunk in chunks])
+    # Callbacks queued from worker threads land before this sentinel
+    done.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (item := await queue.get()) is not None:
+            index, detail = item
+            with _message_cache_lock:
+                _message_cache[(msg_ids[index], include_body, max_chars)] = detail
+            yield index, detail
+        await done
+    finally:
+        done.cancel()
+
+
+async def fetch_messages_in_batch(
+    service, msg_ids: List[str], include_body: bool = False, max_chars: Optional[int] = None
+) -> List[MessageDetail]:
+    """Fetches details for a list of message IDs, keeping the order of ``msg_ids``."""
+    results = {
+        index: detail
+        async for index, detail in iter_messages_in_batch(service, msg_ids, include_body, max_chars)
+    }
+    return [results[i] for i in sorted(results)]
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -210,36 +387,114 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "messages": "/messages",
+            "messages_stream": "/messages/stream",
+            "message_body": "/messages/{message_id}/body",
             "greeting": "/greeting/{name}",
             "docs": "/docs"
         }
     }
 
-@app.get("/messages", response_model=MessagesListResponse, summary="Get Gmail messages")
+@app.get(
+    "/messages",
+    response_model=MessagesListResponse,
+    response_class=ORJSONResponse,
+    summary="Get Gmail messages"
+)
 async def get_gmail_messages(
+    request: HTTPRequest,
     max_results: int = Query(default=10, ge=1, le=100, description="Maximum number of messages to retrieve"),
-    query: str = Query(default="", description="Search query for Gmail messages")
+    query: str = Query(default="", description="Search query for Gmail messages"),
+    include_body: bool = Query(default=False, description="Include the plain-text body of each message; needed to read or summarise email content"),
+    max_chars: int = Query(default=2000, ge=1, description="Maximum number of body characters to decode per message")
 ):
-    try:
-        service = get_service()
-        ids = list_message_ids(service, max_results=max_results, query=query)
-
-        if not ids:
-            return MessagesListResponse(messages=[], count=0, query=query)
+    """
+    List messages matching a Gmail search query.
 
-        detailed_messages = fetch_messages_in_batch(service, ids)
+    By default only headers (subject, sender, recipient, date) are returned and
+    ``body`` is null. Set ``include_body=true`` whenever the task needs the
+    content of the emails, or fetch a single message's body from
+    ``/messages/{message_id}/body``.
+    """
+    try:
+        # googleapiclient is synchronous; keep its network calls off the event loop
+        service = await asyncio.to_thread(get_service)
+
+        # Reuse the last listing for these parameters while the mailbox is unchanged
+        if not include_body:
+            max_chars = None  # ignored without bodies; don't split the cache on it
+        cache_key = (query, max_results, include_body, max_chars)
+        cached = _listing_cache.get(cache_key)
+        if cached and not await asyncio.to_thread(mailbox_changed_since, service, cached[0]):
+            history_id, listing = cached
+        else:
+            # Read the historyId before listing so changes made meanwhile invalidate the entry
+            history_id = await asyncio.to_thread(get_history_id, service)
+            ids = await asyncio.to_thread(
+                list_message_ids, service, max_results=max_results, query=query
+            )
+            detailed_messages = (
+                await fetch_messages_in_batch(
+                    service, ids, include_body=include_body, max_chars=max_chars
+                ) if ids else []
+            )
+            # Dump once; orjson serializes the plain dict on every later hit
+            listing = MessagesListResponse(
+                messages=detailed_messages,
+                count=len(detailed_messages),
+                query=query
+            ).model_dump()
+            _listing_cache[cache_key] = (history_id, listing)
+
+        etag = f'"{history_id}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return ORJSONResponse(content=listing, headers={"ETag": etag})
+    except Exception as e:
+        print(f"Error in get_gmail_messages: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error retrieving messages: {str(e)}"
+        )
 
-        return MessagesListResponse(
-            messages=detailed_messages,
-            count=len(detailed_messages),
-            query=query
+@app.get(
+    "/messages/stream",
+    operation_id="stream_gmail_messages",
+    summary="Stream Gmail messages as NDJSON"
+)
+async def stream_gmail_messages(
+    max_results: int = Query(default=10, ge=1, le=100, description="Maximum number of messages to retrieve"),
+    query: str = Query(default="", description="Search query for Gmail messages"),
+    include_body: bool = Query(default=False, description="Include the plain-text body of each message; needed to read or summarise email content"),
+    max_chars: int = Query(default=2000, ge=1, description="Maximum number of body characters to decode per message")
+):
+    """Stream one JSON object per line as each batch of messages arrives."""
+    try:
+        service = await asyncio.to_thread(get_service)
+        ids = await asyncio.to_thread(
+            list_message_ids, service, max_results=max_results, query=query
         )
     except Exception as e:
-        print(f"Error in get_gmail_messages: {e}")
+        print(f"Error in stream_gmail_messages: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"Error retrieving messages: {str(e)}"
         )
+
+    async def ndjson():
+        async for _, detail in iter_messages_in_batch(service, ids, include_body, max_chars):
+            yield orjson.dumps(detail.model_dump()) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.get("/messages/{message_id}/body", response_model=MessageDetail, summary="Get a Gmail message with its body")
+async def get_gmail_message_body(message_id: str):
+    """Fetch a single message in full, including its plain-text body."""
+    service = await asyncio.to_thread(get_service)
+    msg = await asyncio.to_thread(fetch_message, service, message_id)
+    if msg is None:
+        raise HTTPException(status_code=404, detail=f"Message {message_id} could not be retrieved")
+    return msg
+
 @app.get("/greeting/{name}", response_model=GreetingResponse, summary="Get personalized greeting")
 async def get_greeting(name: str) -> GreetingResponse:
     """
@@ -269,5 +524,15 @@ if __name__ == "__main__":
     print("Server will be available at: http://localhost:8000")
     print("API documentation available at: http://localhost:8000/docs")
     print("Alternative docs at: http://localhost:8000/redoc")
-    
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+
+    if os.getenv("DEV"):
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        # uvicorn's "auto" loop/http pick uvloop and httptools when installed.
+        # MCP sessions live in process memory, so extra workers need sticky routing
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=int(os.getenv("WORKERS", "1")),
+        )
\ No newline at end of file
@@ -1,17 +1,45 @@
-import json
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+import orjson
+from functools import lru_cache
+from langchain_core.messages import AIMessage
 from models.llm import get_llm
 from graph.state import State
 import prompts.google_api_agent_system_prompt
 from prompts.google_api_agent_response_formating_prompt import formatting_prompt
 from mcp_use import MCPAgent, MCPClient
 
-# This is a new, secondary prompt specifically for the formatting step.
+# The formatting instructions are folded into the agent's system prompt so a
+# single MCPAgent run returns the structured JSON the planner expects.
 FORMATTING_PROMPT = formatting_prompt
+COMBINED_SYSTEM_PROMPT = (
+    prompts.google_api_agent_system_prompt.system_prompt
+    + "\n\n" + FORMATTING_PROMPT
+    + "\n\nReturn JSON conforming to: {status, summary, extracted_data, error_message}"
+)
+
+MCP_CONFIG = {"mcpServers": {"GMAIL": {"url": "http://localhost:8000/mcp"},"CALENDER": {"url": "http://localhost:8001/mcp"}}}
+
+# Built once so MCP sessions stay open across turns of the graph. mcp_use's
+# HttpConnector gives each session its own httpx.AsyncClient for the session's
+# lifetime, so keeping the client alive is what pools the connections; a shared
+# client cannot be injected because the transport closes it on disconnect.
+_MCP_CLIENT = MCPClient.from_dict(MCP_CONFIG)
+
+@lru_cache(maxsize=1)
+def _get_agent() -> MCPAgent:
+    """Return the shared MCPAgent, creating it on first use."""
+    # Memory is off so one task's conversation does not leak into the next
+    return MCPAgent(
+        llm=get_llm(),
+        client=_MCP_CLIENT,
+        max_steps=30,
+        system_prompt=COMBINED_SYSTEM_PROMPT,
+        memory_enabled=False,
+    )
+
 async def google_api_agent_node(state: State) -> dict:
     """
-    Interacts with Google APIs via MCPAgent and formats the output
-    into the structured JSON required by the planner.
+    Interacts with Google APIs via MCPAgent, which returns its result
+    directly in the structured JSON required by the planner.
 
     Args:
         state: The current state of the graph.
@@ -21,47 +49,16 @@ async def google_api_agent_node(state: State) -> dict:
     """
     print("---EXECUTING GOOGLE API AGENT---")
     try:
-        config = {"mcpServers": {"GMAIL": {"url": "http://localhost:8000/mcp"},"CALENDER": {"url": "http://localhost:8001/mcp"}}}
-
-    # Create MCPClient from config file
-        client = MCPClient.from_dict(config)
-        llm = get_llm()
-        agent = MCPAgent(llm=llm, client=client, max_steps=30)
+        agent = _get_agent()
         
-        system_prompt = prompts.google_api_agent_system_prompt.system_prompt
         current_task = state.get("current_task", "No task specified")
 
-        # 2. EXECUTE: Use your custom MCPAgent to get the raw data
-        # We create a simple prompt string for your agent's run method
-        mcp_prompt_str = (
-            f"System Prompt: {system_prompt}\n\n"
-            f"User Task: {current_task}"
-        )
+        # EXECUTE + FORMAT: one agent run fetches the data and structures it
         print(f"Passing the following task to MCPAgent:\n{current_task}")
-        
-        # This call gets the raw, unstructured data from the Google API
-        raw_response_from_mcp = await agent.run(mcp_prompt_str)
-        print(f"Received raw response from MCPAgent:\n{raw_response_from_mcp}")
-
-        # 3. FORMAT: Use a separate LLM call to structure the raw response
-        formatting_llm = get_llm()
-        
-        formatting_messages = [
-            SystemMessage(content=FORMATTING_PROMPT),
-            HumanMessage(
-                content=(
-                    f"Original Request: {current_task}\n\n"
-                    f"Raw Tool Output to be formatted:\n---\n{raw_response_from_mcp}\n---"
-                )
-            )
-        ]
-
-        structured_response = formatting_llm.invoke(formatting_messages)
-        
-        final_json_output = structured_response.content
+        final_json_output = await agent.run(current_task)
         print(f"Formatted JSON output for Planner:\n{final_json_output}")
 
-        # 4. UPDATE STATE: Return a dictionary to append the single, structured message
+        # UPDATE STATE: Return a dictionary to append the single, structured message
         # This preserves the history and gives the Planner exactly what it needs.
         return {
             "messages": [AIMessage(content=final_json_output)]
@@ -76,5 +73,5 @@ async def google_api_agent_node(state: State) -> dict:
             "error_message": str(e)
         }
         return {
-            "messages": [AIMessage(content=json.dumps(error_output))]
+            "messages": [AIMessage(content=orjson.dumps(error_output).decode())]
         }
\ No newline at end of file
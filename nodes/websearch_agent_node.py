@@ -23,7 +23,7 @@ async def websearch_agent_node(state: State) -> dict:
             SystemMessage(content=system_prompt),
             HumanMessage(content=current_task)
         ]
-        response_with_tool_call = llm_with_tools.invoke(messages)
+        response_with_tool_call = await llm_with_tools.ainvoke(messages)
         messages.append(response_with_tool_call)
 
         summary = ""
@@ -38,7 +38,7 @@ async def websearch_agent_node(state: State) -> dict:
                     if not search_query:
                         raise ValueError("Search query argument is missing.")
                     print(f"Executing search for query: '{search_query}'")
-                    search_result = search_tool.invoke(search_query)
+                    search_result = await search_tool.ainvoke(search_query)
                     print("Raw DuckDuckGo Search Result received.")
                     messages.append(ToolMessage(content=str(search_result), tool_call_id=tool_call['id']))
                 except Exception as e:
@@ -54,7 +54,7 @@ async def websearch_agent_node(state: State) -> dict:
             messages.append(HumanMessage(content=synthesis_prompt))
 
             print("Synthesizing final answer based on search results...")
-            final_response = llm.invoke(messages) # Use the base LLM without tools for the final answer
+            final_response = await llm.ainvoke(messages) # Use the base LLM without tools for the final answer
             summary = final_response.content
 
         # --- KEY IMPROVEMENT: Check if the summary is empty ---
@@ -1,6 +1,8 @@
 import streamlit as st
 import asyncio
-import json
+import atexit
+import threading
+import orjson
 from typing import Any, Dict, List
 
 # --- Core imports from your LangGraph project ---
@@ -8,7 +10,7 @@ from typing import Any, Dict, List
 from graph.builder import graph, State
 
 # --- NEW: Example Prompts ---
-EXAMPLE_PROMPTS = [
+EXAMPLE_PROMPTS = (
     "--- Select an Example ---",
     "Check my Gmail for unread emails max of 3",
     "Get me the latest unread email from my gmail max of 3, but don't show me any links.",
@@ -18,66 +20,130 @@ EXAMPLE_PROMPTS = [
     "Find information about climate change",
     "Why is Sachin Tendulkar considered the god of cricket?",
     "Give me details about the conflict between Israel and Palestine"
-]
+)
+_EXAMPLES_INDEX = {p: i for i, p in enumerate(EXAMPLE_PROMPTS)}
+
+# Nodes whose LLM output is prose for the user; the planner and the Google API
+# agent emit JSON, which is summarised by format_agent_output instead
+STREAMED_NODES = frozenset({"websearch_agent"})
+
+# --- Helper functions ---
+@st.cache_data(show_spinner=False, max_entries=256, ttl=3600)
+def format_message_content(content: str) -> str:
+    """Formats an agent's JSON message for display, cached on the raw content."""
+    try:
+        data = orjson.loads(content)
+        if data.get("status") == "SUCCESS":
+            return f"✅ **Result:** {data.get('summary', 'No summary provided.')}"
+        else:
+            return f"❌ **Failure:** {data.get('summary', 'An error occurred.')}"
+    except (orjson.JSONDecodeError, TypeError):
+        return f"```\n{content}\n```"
 
-# --- Helper function ---
 def format_agent_output(output: Dict[str, Any]) -> str:
     """Parses and formats the output from agent nodes for display."""
     if isinstance(output, dict) and "messages" in output:
         last_message = output["messages"][-1]
         content = last_message.content
-        try:
-            data = json.loads(content)
-            if data.get("status") == "SUCCESS":
-                return f"✅ **Result:** {data.get('summary', 'No summary provided.')}"
-            else:
-                return f"❌ **Failure:** {data.get('summary', 'An error occurred.')}"
-        except (json.JSONDecodeError, TypeError):
-            return f"```\n{content}\n```"
+        if isinstance(content, str):
+            return format_message_content(content)
+        return f"```\n{content}\n```"
     if isinstance(output, dict) and "current_task" in output:
         return f"📋 **Next Task:** {output['current_task']}"
     return f"```\n{str(output)}\n```"
 
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the process-wide event loop, running on its own thread.
+
+    The MCP client and agent in the Google API node are module-level singletons,
+    so every Streamlit session must drive them from this one loop.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="graph-event-loop", daemon=True).start()
+    atexit.register(loop.call_soon_threadsafe, loop.stop)
+    return loop
+
+async def _next_event(events):
+    """Awaits the next graph event, returning None once the stream is exhausted."""
+    try:
+        return await anext(events)
+    except StopAsyncIteration:
+        return None
+
+async def _close_events(events):
+    await events.aclose()
+
 # --- REFACTORED: Agent Execution Logic ---
-async def execute_graph(prompt: str):
-    """Adds the prompt to the UI and runs the agent graph, streaming the output."""
+def execute_graph(prompt: str):
+    """Adds the prompt to the UI and runs the agent graph, streaming LLM tokens as they arrive."""
     st.session_state.messages.append({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.status("🧠 Agent is thinking...", expanded=True) as status:
-            final_answer = ""
-            initial_state = State(messages=[{"role": "user", "content": prompt}])
-
-            async for event in graph.astream_events(initial_state, version="v1"):
-                kind = event["event"]
-                
-                if kind == "on_chain_start":
-                    node_name = event["name"]
-                    status.write(f"▶️ **Executing:** `{node_name}`")
-
-                elif kind == "on_chain_end":
-                    node_name = event["name"]
-                    if node_name == "LangGraph" or "__graph__" in node_name:
-                        continue
-                    output = event["data"].get("output")
-                    is_final_planner_step = isinstance(output, dict) and output.get("next_agent") == "END"
-                    status.write(f"☑️ **Finished:** `{node_name}`")
-                    if is_final_planner_step:
-                        status.write("✅ Plan complete. Generating final answer...")
-                    else:
-                        formatted_output = format_agent_output(output)
-                        status.markdown(formatted_output)
-                    
-                elif kind == "on_graph_end":
-                    final_state = event["data"]["output"]
-                    final_answer = final_state.get("final_answer", "I have completed the task, but no final answer was generated.")
+        # Node progress goes in the status panel; streamed prose is written below
+        # it so it stays visible after the panel collapses
+        status = st.status("🧠 Agent is thinking...", expanded=True)
+        final_answer = ""
+        initial_state = State(messages=[{"role": "user", "content": prompt}])
+
+        def stream_tokens():
+            """Drives the graph on the shared loop, yielding tokens and logging node events."""
+            nonlocal final_answer
+            streamed_run_id = None
+            events = graph.astream_events(initial_state, version="v1")
+            try:
+                while (event := asyncio.run_coroutine_threadsafe(_next_event(events), loop).result()) is not None:
+                    kind = event["event"]
+
+                    if kind == "on_chat_model_stream":
+                        if event.get("metadata", {}).get("langgraph_node") not in STREAMED_NODES:
+                            continue
+                        token = event["data"]["chunk"].content
+                        if token:
+                            # Separate the output of consecutive model calls
+                            if streamed_run_id not in (None, event["run_id"]):
+                                yield "\n\n"
+                            streamed_run_id = event["run_id"]
+                            yield token
+
+                    elif kind == "on_chain_start":
+                        node_name = event["name"]
+                        status.write(f"▶️ **Executing:** `{node_name}`")
+
+                    elif kind == "on_chain_end":
+                        node_name = event["name"]
+                        if node_name == "LangGraph":
+                            # The graph's own end event carries the final state
+                            final_state = event["data"].get("output") or {}
+                            final_answer = final_state.get("final_answer") or "I have completed the task, but no final answer was generated."
+                            continue
+                        if "__graph__" in node_name:
+                            continue
+                        output = event["data"].get("output")
+                        is_final_planner_step = isinstance(output, dict) and output.get("next_agent") == "END"
+                        status.write(f"☑️ **Finished:** `{node_name}`")
+                        if is_final_planner_step:
+                            status.write("✅ Plan complete. Generating final answer...")
+                        else:
+                            formatted_output = format_agent_output(output)
+                            status.markdown(formatted_output)
+
+            finally:
+                asyncio.run_coroutine_threadsafe(_close_events(events), loop).result()
 
+        try:
+            st.write_stream(stream_tokens())
             status.update(label="✅ Task Complete!", state="complete", expanded=False)
-            st.markdown(output.get("final_answer"))
-            
-            st.session_state.messages.append({"role": "assistant", "content": final_answer})
+        finally:
+            # Keep the turn in history even if the graph failed part-way
+            st.session_state.messages.append(
+                {"role": "assistant", "content": final_answer or "⚠️ The task did not complete."}
+            )
+
+        st.markdown(final_answer)
 
 # --- Main Streamlit App UI ---
 st.set_page_config(page_title="Multi-Agent System", layout="wide")
@@ -101,6 +167,9 @@ with st.sidebar:
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Shared by all sessions so the cached MCP client stays on the loop it was opened on
+loop = get_event_loop()
+
 # Display past messages from session state
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -110,7 +179,7 @@ for message in st.session_state.messages:
 prompt_to_run = None
 
 # Check if the sidebar button was clicked with a valid example
-if run_example_button and selected_example != EXAMPLE_PROMPTS[0]:
+if run_example_button and _EXAMPLES_INDEX.get(selected_example, 0) > 0:
     prompt_to_run = selected_example
 
 # Check if the user typed in the main chat input
@@ -119,4 +188,4 @@ if chat_input := st.chat_input("Or type your own request here..."):
 
 # If there's a prompt to run, execute the graph
 if prompt_to_run:
-    asyncio.run(execute_graph(prompt_to_run))
\ No newline at end of file
+    execute_graph(prompt_to_run)
\ No newline at end of file